@@ -13,35 +13,64 @@ import serial
 import time
 import threading
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import sys 
-from flask import Flask, render_template, jsonify, request, flash
-from datetime import datetime
+import os
+from flask import Flask, render_template, request, Response
 import serial.tools.list_ports 
+import orjson
 import random 
+import selectors
+import queue
+import logging
+import struct
+import re
+from dataclasses import dataclass, replace
 
 # --- 1. CONFIGURATION ---
 # IMPORTANT: These values are read from command-line arguments when using install.sh
+LOG_LEVEL = os.environ.get('PLANTMONITOR_LOG_LEVEL', 'INFO').strip().upper() # e.g. WARNING to quiet per-event messages
+log_level_valid = isinstance(logging.getLevelName(LOG_LEVEL), int)
+
+logging.basicConfig(level=LOG_LEVEL if log_level_valid else logging.INFO,
+                    format='%(levelname)s [%(threadName)s] %(message)s')
+log = logging.getLogger(__name__)
+if not log_level_valid:
+    # A typo in the service file shouldn't stop the app from starting
+    log.warning("Unknown PLANTMONITOR_LOG_LEVEL %r, using INFO.", LOG_LEVEL)
+
 BAUD_RATE = 9600
+SERIAL_SILENCE_TIMEOUT_SECONDS = 10  # Reconnect if the Arduino (reporting every 1s) goes quiet this long
 WEATHER_API_INTERVAL_SECONDS = 3600  # Check weather once per hour (3600 seconds)
+WEATHER_RETRY_INTERVAL_SECONDS = 300 # After a failed update, try again in 5 minutes instead of an hour
+WEATHER_BACKOFF_MAX_SECONDS = 32     # Cap for the exponential backoff between retries
+WEATHER_IDLE_CHECK_SECONDS = 60      # While nobody needs the weather, re-check for a viewer this often
+DASHBOARD_IDLE_SECONDS = 120         # A dashboard counts as open if it polled /data this recently
 SCHEDULER_INTERVAL_SECONDS = 60      # Check watering conditions every minute
 
 # OpenWeatherMap API Configuration (Sign up for a free key)
 
-# Check if an API key (sys.argv[1]) and City Name (sys.argv[2]) were passed
-if len(sys.argv) > 2:
-    API_KEY = sys.argv[1]
-    CITY_NAME = sys.argv[2]
-    print(f"API Key loaded from command-line. City set to: {CITY_NAME}")
-elif len(sys.argv) > 1:
-    API_KEY = sys.argv[1]
+# Pass --legacy-csv when the Arduino runs firmware that still prints CSV lines
+LEGACY_CSV = '--legacy-csv' in sys.argv
+# Pass --dev to use Flask's built-in server instead of gunicorn
+DEV_SERVER = '--dev' in sys.argv
+args = [arg for arg in sys.argv[1:] if arg not in ('--legacy-csv', '--dev')]
+
+# Check if an API key (args[0]) and City Name (args[1]) were passed
+if len(args) > 1:
+    API_KEY = args[0]
+    CITY_NAME = args[1]
+    log.info("API Key loaded from command-line. City set to: %s", CITY_NAME)
+elif len(args) > 0:
+    API_KEY = args[0]
     CITY_NAME = "London" # Default if only API key is provided
-    print("WARNING: Only API Key provided. Using default city: London.")
+    log.warning("Only API Key provided. Using default city: London.")
 else:
     # FALLBACK: Use placeholders if no arguments are provided
     API_KEY = "YOUR_OPENWEATHERMAP_API_KEY" 
     CITY_NAME = "London"
-    print("WARNING: Using default API Key and City. Pass key and city as arguments.")
+    log.warning("Using default API Key and City. Pass key and city as arguments.")
 
 WEATHER_URL = f"http://api.openweathermap.org/data/2.5/weather?q={CITY_NAME}&appid={API_KEY}&units=metric"
 
@@ -49,148 +78,481 @@ WEATHER_URL = f"http://api.openweathermap.org/data/2.5/weather?q={CITY_NAME}&app
 MOISTURE_THRESHOLD = 500  # If raw value is > 500 (drier), trigger water
 DRY_VALUE_MAX = 650       # Your MAX DRY value from calibration (e.g., sensor in air)
 WET_VALUE_MIN = 300       # Your MIN WET value from calibration (e.g., sensor in water)
+MOISTURE_RANGE_SPAN = DRY_VALUE_MAX - WET_VALUE_MIN # Precomputed once for the serial loop
+RAIN_GROUP_MASK = (1 << 2) | (1 << 3) | (1 << 5) | (1 << 6) # OpenWeatherMap groups 2xx, 3xx, 5xx, 6xx (storm, drizzle, rain, snow) as bits
 WEATHER_RAIN_CHANCE_DELAY = 30  # If weather forecast predicts > 30% chance of rain, delay automatic watering
 
 WATERING_DURATION_SECONDS = 3 # How long the pump runs when activated
 
+ARDUINO_PORT_HINTS = ('Arduino', 'USB Serial') # Matched against port descriptions
+
+ASYNC_LOW_LATENCY = 0x2000 # Linux serial driver flag, see <linux/tty_flags.h>
+
+# Binary sensor packet sent by plant-controller.ino (7 bytes, little-endian):
+# sync 0xAA | uint16 moisture raw | float16 temp C | uint8 humidity % | uint8 CRC-8
+SENSOR_PACKET = struct.Struct('<BHeBB')
+PACKET_SYNC = 0xAA # Never appears in the sketch's ASCII status text
+MAX_TEXT_LINE_BYTES = 128 # Longest partial status line kept while waiting for its newline
+LEGACY_CSV_LINE = re.compile(rb'^\d+,-?\d+(\.\d+)?,-?\d+(\.\d+)?\r?$', re.MULTILINE) # Old firmware's sample line
+
 # --- 2. GLOBAL STATE ---
-# Shared dictionary to hold the latest sensor readings and status
-system_state = {
-    'moisture_raw': 0,
-    'moisture_percent': 0,
-    'temp_c': 0.0,
-    'temp_f': 0.0,
-    'humidity': 0.0,
-    'last_update': 'N/A',
-    'weather_desc': 'Fetching...',
-    'weather_rain': False,
-    'last_water': 'N/A',
-    'auto_watering_enabled': True,
-    'arduino_connected': False # New flag for connection status
-}
+# Immutable snapshot of the latest sensor readings and status. Writers publish
+# a new snapshot with update_state(), so readers on other threads always see a
+# consistent set of values (e.g. temp_c and temp_f from the same sample).
+@dataclass(slots=True, frozen=True)
+class SystemState:
+    moisture_raw: int = 0
+    moisture_percent: int = 0
+    temp_c: float = 0.0
+    temp_f: float = 0.0
+    humidity: float = 0.0
+    last_update: str = 'N/A'
+    weather_desc: str = 'Fetching...'
+    weather_rain: bool = False
+    last_water: str = 'N/A'
+    auto_watering_enabled: bool = True
+    watering_in_progress: bool = False # True while a pump cycle is running
+    arduino_connected: bool = False # New flag for connection status
+
+system_state = SystemState()
+
+# Serializes writers so two threads never build a snapshot from the same base
+state_lock = threading.Lock()
+
+# Set when the soil turns dry or the rain delay lifts, so the scheduler reacts
+# right away instead of on its next timed check. An Event (rather than a bare
+# Condition) remembers a wake-up that arrives while the scheduler is busy.
+scheduler_wakeup = threading.Event()
+
+# Wakes an idle weather thread when auto-watering is re-enabled or a dashboard
+# opens. weather_refresh_pending is True from the moment the thread starts
+# skipping updates until its next fetch cycle has finished, and the scheduler
+# holds off while it is set so it never decides on days-old rain data.
+weather_wakeup = threading.Event()
+weather_refresh_pending = False
+
+# Set once the old-firmware warning has been logged, so it isn't repeated
+legacy_csv_warned = False
+
+# time.monotonic() of the last automatic WET, used to space out pump cycles
+last_auto_water = None
 
 # Variable for the Serial Connection object
 ser = None
 
+# Port path of the last Arduino found, checked first when reconnecting
+last_arduino_port = None
+
+# Outgoing commands. Only the serial thread writes to the port: every other
+# thread queues its commands here and pokes the wake-up pipe, which the serial
+# thread's selector watches alongside the port.
+tx_queue = queue.SimpleQueue()
+tx_wakeup_r, tx_wakeup_w = os.pipe()
+os.set_blocking(tx_wakeup_r, False)
+os.set_blocking(tx_wakeup_w, False)
+
+# Rendered dashboard HTML keyed by arduino_connected. The page is a static shell
+# filled in by dashboard.js, so only the connection warning ever changes it.
+index_html_cache = {}
+
+# time.monotonic() of the last /data poll, so background work can tell if anyone is watching
+last_dashboard_poll = 0.0
+
+# Serialized /data body and the snapshot it was built from, shared by every
+# dashboard tab until the state changes
+data_cache = (None, b'')
+
+# One pooled HTTP session, so the weather thread reuses its connection across
+# hours and retries. Retries stay off here, the thread does its own backoff.
+weather_session = requests.Session()
+for scheme in ('http://', 'https://'):
+    weather_session.mount(scheme, HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0))
+
+# (epoch second, "HH:MM:SS") pair, rebound as a whole so readers never see a torn pair
+timestamp_cache = (0, '')
+
+# Last successful weather reading, served (marked stale) when the API is unreachable
+last_weather = {'ts': 0.0, 'desc': None, 'rain': False}
+
+def now_hms():
+    """Returns the local time as HH:MM:SS, formatted at most once per second."""
+    global timestamp_cache
+    now = int(time.time())
+    if timestamp_cache[0] != now:
+        timestamp_cache = (now, time.strftime("%H:%M:%S", time.localtime(now)))
+    return timestamp_cache[1]
+
+def update_state(**changes):
+    """Publishes a new system_state snapshot with the given fields changed."""
+    global system_state
+    with state_lock:
+        previous = system_state
+        # Rebinding the module global is atomic, readers get the old or new snapshot
+        system_state = current = replace(previous, **changes)
+
+    became_dry = previous.moisture_raw <= MOISTURE_THRESHOLD < current.moisture_raw
+    rain_cleared = previous.weather_rain and not current.weather_rain
+    if became_dry or rain_cleared:
+        wake_scheduler()
+    return current
+
+
+def wake_scheduler():
+    """Wakes the auto-watering scheduler so it re-checks conditions now."""
+    scheduler_wakeup.set()
+
 # --- 3. SERIAL COMMUNICATION THREAD ---
 
 def find_arduino_port():
     """Searches for a connected Arduino device."""
+    global last_arduino_port
+
+    # The same device usually comes back on the same path, so try it before
+    # walking every port in sysfs again
+    if last_arduino_port and os.path.exists(last_arduino_port):
+        return last_arduino_port
+
     # List all available serial ports
     ports = list(serial.tools.list_ports.comports())
     
     for port in ports:
         # Check for common Arduino identifiers (adjust if necessary for your clone/board)
-        if 'Arduino' in port.description or 'USB Serial' in port.description or 'ACM' in port.device:
-            print(f"Found Arduino device on port: {port.device}")
+        if any(hint in port.description for hint in ARDUINO_PORT_HINTS) or 'ACM' in port.device:
+            log.info("Found Arduino device on port: %s", port.device)
+            last_arduino_port = port.device
             return port.device
             
     return None
 
 
+def enable_low_latency(port):
+    """Turns on ASYNC_LOW_LATENCY so the driver hands over bytes immediately
+    instead of batching them on its 16 ms receive timer. Returns a short
+    description of how (or whether) it was enabled, for the connect log."""
+    try:
+        port.set_low_latency_mode(True)
+        return "pyserial low_latency_mode"
+    except AttributeError:
+        pass # Older pyserial or non-Linux build, try the ioctl directly below
+    except (NotImplementedError, ValueError, IOError):
+        return "unavailable"
+
+    try:
+        import fcntl
+        import termios
+        import array
+        # struct serial_struct is read as ints, 'flags' is the fifth field
+        buf = array.array('i', [0] * 32)
+        tiocgserial = getattr(termios, 'TIOCGSERIAL', 0x541E)
+        tiocsserial = getattr(termios, 'TIOCSSERIAL', 0x541F)
+        fcntl.ioctl(port.fileno(), tiocgserial, buf)
+        buf[4] |= ASYNC_LOW_LATENCY
+        fcntl.ioctl(port.fileno(), tiocsserial, buf)
+        return "TIOCSSERIAL ioctl"
+    except (ImportError, AttributeError, NotImplementedError, IOError):
+        return "unavailable"
+
+
+def crc8_table_entry(value):
+    """Computes one CRC-8/MAXIM lookup table entry (reflected polynomial 0x8C)."""
+    for _ in range(8):
+        value = (value >> 1) ^ 0x8C if value & 1 else value >> 1
+    return value
+
+CRC8_TABLE = bytes(crc8_table_entry(i) for i in range(256))
+
+
+def crc8(data):
+    """CRC-8/MAXIM (Dallas 1-Wire) checksum, matching crc8() in the sketch."""
+    crc = 0
+    for byte in data:
+        crc = CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def parse_sensor_packets(buf):
+    """Pulls every complete binary sensor packet out of buf (consumed in place).
+
+    Returns a list of (moisture_raw, temp_c, humidity) tuples. Bytes before a
+    sync byte, such as the sketch's status text, are discarded, and a packet
+    with a bad CRC only drops its sync byte so the stream can re-align."""
+    samples = []
+    while True:
+        start = buf.find(PACKET_SYNC)
+        if start < 0:
+            # Drop complete text lines but keep a trailing partial one, so a
+            # CSV line from old firmware can be recognized once it is whole
+            end = buf.rfind(b'\n') + 1
+            if len(buf) - end > MAX_TEXT_LINE_BYTES:
+                end = len(buf)
+            discard_text(buf, end)
+            return samples
+        if start:
+            discard_text(buf, start)
+        if len(buf) < SENSOR_PACKET.size:
+            return samples # Wait for the rest of the packet
+
+        sync, moisture_raw, temp_c, humidity, crc = SENSOR_PACKET.unpack_from(buf)
+        if crc8(buf[1:SENSOR_PACKET.size - 1]) != crc:
+            log.warning("Dropping sensor packet with bad CRC.")
+            del buf[:1]
+            continue
+
+        del buf[:SENSOR_PACKET.size]
+        samples.append((moisture_raw, temp_c, humidity))
+
+
+def discard_text(buf, length):
+    """Drops the first length bytes of buf, warning (once) if they hold the
+    CSV sample lines that pre-binary firmware sends."""
+    global legacy_csv_warned
+    if not legacy_csv_warned and LEGACY_CSV_LINE.search(buf, 0, length):
+        legacy_csv_warned = True
+        log.warning("The Arduino is sending CSV text lines. Its sketch predates the binary "
+                    "protocol: re-flash plant-controller.ino, or start app.py with --legacy-csv.")
+    del buf[:length]
+
+
+def parse_sensor_lines(buf):
+    """Legacy CSV protocol: pulls every complete MOISTURE_RAW,TEMP_C,HUMIDITY_PCT
+    line out of buf (consumed in place), for firmware built with LEGACY_CSV."""
+    end = buf.rfind(b'\n')
+    if end < 0:
+        return []
+    lines = buf[:end].split(b'\n')
+    del buf[:end + 1] # Only keep the incomplete line
+
+    samples = []
+    for line in lines:
+        parts = line.split(b',')
+        if len(parts) != 3:
+            continue # Status text such as "Command Received: WET"
+        try:
+            # int()/float() accept ASCII bytes directly, no decode needed
+            samples.append((int(parts[0]), float(parts[1]), float(parts[2])))
+        except ValueError:
+            continue # Garbled line, wait for the next sample
+    return samples
+
+
+def publish_sample(moisture_raw, temp_c, humidity):
+    """Converts one sensor sample and publishes it as a new state snapshot."""
+    # Calculate relative moisture percentage (for display)
+    # Clamping to the calibrated range already keeps it within 0-100
+    clamped_value = moisture_raw
+    if clamped_value < WET_VALUE_MIN:
+        clamped_value = WET_VALUE_MIN
+    elif clamped_value > DRY_VALUE_MAX:
+        clamped_value = DRY_VALUE_MAX
+
+    update_state(
+        moisture_raw=moisture_raw,
+        moisture_percent=100 - (clamped_value - WET_VALUE_MIN) * 100 // MOISTURE_RANGE_SPAN,
+        temp_c=temp_c,
+        temp_f=(temp_c * 9/5) + 32, # Convert to Fahrenheit
+        humidity=humidity,
+        last_update=now_hms(),
+    )
+
+
 def read_serial_thread():
     """Continuously reads sensor data from the Arduino via USB serial."""
-    global system_state, ser
+    global ser
 
-    # Loop to continuously try finding and connecting to the Arduino
-    while ser is None:
-        port_path = find_arduino_port()
-        if port_path:
-            try:
-                ser = serial.Serial(port_path, BAUD_RATE, timeout=1)
-                time.sleep(2) # Wait for the Arduino to reset
-                ser.flushInput()
-                system_state['arduino_connected'] = True
-                print(f"Serial connection established on {port_path}")
-                break
-            except serial.SerialException as e:
-                print(f"ERROR: Could not open serial port {port_path}. Retrying in 5s.")
-                ser = None 
-                time.sleep(5)
-                system_state['arduino_connected'] = False
-        else:
-            print("Arduino not found. Simulating sensor data for testing. Retrying scan in 10s...")
-            # If no Arduino found, we simulate data to keep the Flask app running
-            system_state['moisture_raw'] = random.randint(400, 700)
-            system_state['temp_c'] = random.uniform(18.0, 28.0)
-            system_state['humidity'] = random.uniform(30.0, 60.0)
-            system_state['last_update'] = datetime.now().strftime("%H:%M:%S")
-            time.sleep(10)
-            system_state['arduino_connected'] = False
-            
-    # Main reading loop once connection is established
     while True:
+        # Loop to continuously try finding and connecting to the Arduino
+        while ser is None:
+            port_path = find_arduino_port()
+            if port_path:
+                try:
+                    ser = serial.Serial(port_path, BAUD_RATE, timeout=0.5)
+                    time.sleep(2) # Wait for the Arduino to reset
+                    ser.flushInput()
+                    latency_mode = enable_low_latency(ser)
+                    update_state(arduino_connected=True)
+                    log.info("Serial connection established on %s (low latency: %s)", port_path, latency_mode)
+                    break
+                except serial.SerialException as e:
+                    log.error("Could not open serial port %s (%s). Retrying in 5s.", port_path, e)
+                    ser = None 
+                    time.sleep(5)
+                    update_state(arduino_connected=False)
+            else:
+                log.info("Arduino not found. Simulating sensor data for testing. Retrying scan in 10s...")
+                # If no Arduino found, we simulate data to keep the Flask app running
+                temp_c = random.uniform(18.0, 28.0)
+                update_state(
+                    moisture_raw=random.randint(400, 700),
+                    temp_c=temp_c,
+                    temp_f=(temp_c * 9/5) + 32,
+                    humidity=random.uniform(30.0, 60.0),
+                    last_update=now_hms(),
+                )
+                time.sleep(10)
+                update_state(arduino_connected=False)
+
+        # Block on the serial file descriptor instead of polling in_waiting,
+        # so the thread only wakes up when the Arduino has actually sent bytes
+        # or another thread has queued a command.
+        selector = selectors.DefaultSelector()
+        selector.register(ser.fileno(), selectors.EVENT_READ, 'rx')
+        selector.register(tx_wakeup_r, selectors.EVENT_READ, 'tx')
+
+        # Main reading loop once connection is established
+        # Bytes are accumulated here and consumed in place by the parser
+        buf = bytearray()
+        parse_samples = parse_sensor_lines if LEGACY_CSV else parse_sensor_packets
+        last_sample = time.monotonic()
         try:
-            if ser and ser.in_waiting > 0:
-                line = ser.readline().decode('utf-8').strip() 
-                
-                # Expected format from Arduino: MOISTURE_RAW,TEMP_C,HUMIDITY_PCT
-                if line:
-                    parts = line.split(',')
-                    if len(parts) == 3:
-                        moisture_raw = int(parts[0])
-                        temp_c = float(parts[1])
-                        humidity = float(parts[2])
-                        
-                        # Update global state
-                        system_state['moisture_raw'] = moisture_raw
-                        system_state['temp_c'] = temp_c
-                        system_state['temp_f'] = (temp_c * 9/5) + 32 # Convert to Fahrenheit
-                        system_state['humidity'] = humidity
-                        system_state['last_update'] = datetime.now().strftime("%H:%M:%S")
-
-                        # Calculate relative moisture percentage (for display)
-                        range_span = DRY_VALUE_MAX - WET_VALUE_MIN
-                        clamped_value = max(WET_VALUE_MIN, min(DRY_VALUE_MAX, moisture_raw))
-                        moisture_pct = 100 - int(((clamped_value - WET_VALUE_MIN) / range_span) * 100)
-                        system_state['moisture_percent'] = max(0, min(100, moisture_pct))
+            while True:
+                # Sleep until data arrives, but no longer than the silence deadline
+                remaining = last_sample + SERIAL_SILENCE_TIMEOUT_SECONDS - time.monotonic()
+                if remaining <= 0:
+                    raise serial.SerialException(f"no sensor data for {SERIAL_SILENCE_TIMEOUT_SECONDS}s")
+
+                for key, _ in selector.select(timeout=remaining):
+                    if key.data == 'tx':
+                        drain_tx_wakeups()
+                        continue
+                    buf += ser.read(ser.in_waiting or 1)
+                    for moisture_raw, temp_c, humidity in parse_samples(buf):
+                        publish_sample(moisture_raw, temp_c, humidity)
+                        last_sample = time.monotonic()
+
+                flush_tx_queue(ser)
 
         except Exception as e:
-            print(f"Error reading serial data ({e}). Connection lost. Attempting to re-find port.")
+            log.error("Error reading serial data (%s). Connection lost. Attempting to re-find port.", e)
+            try:
+                ser.close()
+            except Exception:
+                pass
             ser = None # Reset serial connection on error to trigger re-connect
-            system_state['arduino_connected'] = False
-            # Break the inner loop to restart the port finding logic
-            break 
-        
-        time.sleep(1)
+            update_state(arduino_connected=False)
+            # Don't fire stale commands (e.g. a WET) whenever the device comes back
+            dropped = take_tx_queue()
+            if dropped:
+                log.warning("Discarding unsent command(s) %s.", dropped)
+        finally:
+            # Drop the stale descriptor before the port finding logic runs again
+            selector.close()
 
 
-def send_command_to_arduino(command):
-    """Sends a command string to the Arduino (e.g., "WET" or "LIGHT ON")."""
+def try_begin_watering():
+    """Claims the pump for a new cycle. Returns False if one is already running.
+
+    The check and the set happen under state_lock, so two request threads (or a
+    request and the scheduler) can't both start a cycle."""
+    global system_state
+    with state_lock:
+        if system_state.watering_in_progress:
+            return False
+        system_state = replace(system_state, watering_in_progress=True)
+        return True
+
+
+def start_watering_timer():
+    """Clears the watering flag once the pump cycle has finished."""
+    # Wait for pump duration + 1s buffer without blocking the caller
+    timer = threading.Timer(WATERING_DURATION_SECONDS + 1, clear_watering_flag)
+    timer.daemon = True
+    timer.start()
+
+
+def clear_watering_flag():
+    """Marks the current pump cycle as complete."""
+    update_state(watering_in_progress=False)
+
+
+def send_commands_to_arduino(commands):
+    """Queues command strings for the serial thread, which sends everything
+    queued since its last pass in a single write. Returns False if there is
+    no serial connection to send them on."""
+    if not commands:
+        return True
     if ser and ser.is_open:
+        for command in commands:
+            tx_queue.put(command)
         try:
-            # Commands MUST end with a newline character (\n) for Arduino's readline() to work
-            ser.write(f"{command}\n".encode('utf-8'))
-            print(f"Command sent to Arduino: {command}")
-            return True
-        except Exception as e:
-            print(f"Failed to send command: {e}")
-            return False
+            os.write(tx_wakeup_w, b'\0')
+        except BlockingIOError:
+            pass # Pipe is already full of wake-ups, the serial thread will see them
+        return True
     else:
-        print(f"ERROR: Cannot send command '{command}'. Serial connection is not open.")
+        log.error("Cannot send command(s) %s. Serial connection is not open.", commands)
         return False
 
+
+def take_tx_queue():
+    """Removes and returns every command currently queued."""
+    commands = []
+    try:
+        while True:
+            commands.append(tx_queue.get_nowait())
+    except queue.Empty:
+        return commands
+
+
+def drain_tx_wakeups():
+    """Empties the wake-up pipe so the selector stops reporting it."""
+    try:
+        while os.read(tx_wakeup_r, 4096):
+            pass
+    except BlockingIOError:
+        pass
+
+
+def flush_tx_queue(port):
+    """Writes all queued commands to the port. Only called by the serial thread."""
+    commands = take_tx_queue()
+    if commands:
+        # Commands MUST end with a newline character (\n) for Arduino's readline() to work
+        # One write per batch, so several commands share a single USB transfer
+        port.write(("\n".join(commands) + "\n").encode('utf-8'))
+        log.info("Command(s) sent to Arduino: %s", commands)
+
+
+def send_command_to_arduino(command):
+    """Sends a command string to the Arduino (e.g., "WET" or "LIGHT ON")."""
+    return send_commands_to_arduino([command])
+
 # --- 4. WEATHER & SCHEDULE LOGIC THREADS ---
 
 def update_weather_thread():
     """Fetches real-time weather data from OpenWeatherMap."""
-    global system_state
+    global weather_refresh_pending
     
-    # We use exponential backoff for API retries (1s, 2s, 4s, 8s, 16s) 
+    # We use exponential backoff for API retries (1s, 2s, 4s, 8s), plus up to
+    # 1s of random jitter so many installs don't retry in lockstep after an outage
     max_retries = 5 
     
     while True:
         if API_KEY == "YOUR_OPENWEATHERMAP_API_KEY":
             # Skip API call if key is still default
-            print("Weather API key placeholder detected. Skipping API call.")
+            log.warning("Weather API key placeholder detected. Skipping API call.")
             time.sleep(WEATHER_API_INTERVAL_SECONDS)
             continue
-            
+
+        # Nothing uses the weather while auto-watering is off and no dashboard is open,
+        # so save the API call (and quota) until one of those changes
+        dashboard_idle = time.monotonic() - last_dashboard_poll > DASHBOARD_IDLE_SECONDS
+        if not system_state.auto_watering_enabled and dashboard_idle:
+            weather_refresh_pending = True
+            weather_wakeup.wait(timeout=WEATHER_IDLE_CHECK_SECONDS)
+            weather_wakeup.clear()
+            continue
+
+        success = False
         for attempt in range(max_retries):
             try:
-                response = requests.get(WEATHER_URL, timeout=10)
-                response.raise_for_status() # Raise exception for bad status codes (4xx or 5xx)
-                data = response.json()
+                # Stream so the headers can be checked before the body is downloaded;
+                # the with-block closes the connection on every path
+                with weather_session.get(WEATHER_URL, timeout=10, stream=True) as response:
+                    response.raise_for_status() # Raise exception for bad status codes (4xx or 5xx)
+                    if 'json' not in response.headers.get('Content-Type', ''):
+                        # e.g. a captive portal or ISP redirect page
+                        raise ValueError(f"expected JSON, got {response.headers.get('Content-Type', 'no content type')}")
+                    data = response.json()
                 
                 # Check for weather conditions that indicate precipitation or high cloud cover
                 # OpenWeatherMap uses a group ID for main weather condition. Group 5xx is Rain.
@@ -199,56 +561,113 @@ def update_weather_thread():
                 
                 # Simple check for Rain/Snow/Drizzle (Group IDs 2xx, 3xx, 5xx, 6xx)
                 # You can enhance this with forecast data if using a different API endpoint.
-                is_raining = (data['weather'][0]['id'] // 100 in [2, 3, 5, 6])
+                is_raining = bool((RAIN_GROUP_MASK >> (data['weather'][0]['id'] // 100)) & 1)
                 
-                system_state['weather_desc'] = weather_desc.capitalize()
-                system_state['weather_rain'] = is_raining
-                print(f"Weather Update: {weather_desc}. Rain Check: {is_raining}.")
+                update_state(weather_desc=weather_desc.capitalize(), weather_rain=is_raining)
+                last_weather.update(ts=time.time(), desc=weather_desc.capitalize(), rain=is_raining)
+                log.info("Weather Update: %s. Rain Check: %s.", weather_desc, is_raining)
+                success = True
                 break # Success! Break the retry loop
                 
             except requests.exceptions.RequestException as e:
-                print(f"Weather API request failed (Attempt {attempt+1}/{max_retries}): {e}")
-                time.sleep(2 ** attempt) # Exponential backoff
+                log.warning("Weather API request failed (Attempt %d/%d): %s", attempt + 1, max_retries, e)
+                if attempt < max_retries - 1:
+                    # Exponential backoff with jitter
+                    time.sleep(min(WEATHER_BACKOFF_MAX_SECONDS, 2 ** attempt) + random.uniform(0, 1))
             except Exception as e:
-                print(f"Error parsing weather data: {e}")
+                log.error("Error parsing weather data: %s", e)
                 break # Give up on current cycle
 
-        time.sleep(WEATHER_API_INTERVAL_SECONDS)
+        if not success:
+            # Every attempt failed or the reply wasn't usable (e.g. a captive portal),
+            # fall back to the last good reading if there is one
+            if last_weather['desc'] is not None:
+                age_minutes = int((time.time() - last_weather['ts']) // 60)
+                update_state(weather_desc=f"{last_weather['desc']} (stale, {age_minutes} min old)",
+                             weather_rain=last_weather['rain'])
+                log.warning("Weather API unavailable. Serving stale weather from %d min ago: %s.", age_minutes, last_weather['desc'])
+            else:
+                update_state(weather_desc='Weather unavailable')
+
+        if weather_refresh_pending:
+            # First cycle after an idle stretch, the scheduler was waiting for it
+            weather_refresh_pending = False
+            wake_scheduler()
+
+        # Check again soon after a failure, otherwise wait for the regular interval
+        time.sleep(WEATHER_API_INTERVAL_SECONDS if success else WEATHER_RETRY_INTERVAL_SECONDS)
+
+
+def run_scheduler_check():
+    """Runs one auto-watering check and triggers the pump if conditions are met."""
+    global last_auto_water
+
+    # Commands queued during this check, flushed in one write at the end
+    pending_commands = []
+
+    # Work from one snapshot so every check sees the same reading
+    state = system_state
+
+    if state.auto_watering_enabled and weather_refresh_pending:
+        log.info("AUTO-WATERING DEFERRED: Waiting for a weather update after the idle period.")
+
+    elif state.auto_watering_enabled:
+        
+        # Condition 1: Is the soil dry enough?
+        is_dry = state.moisture_raw > MOISTURE_THRESHOLD
+        
+        # Condition 2: Is it raining or about to rain?
+        is_rain_delay = state.weather_rain
+
+        # Condition 3: Has the last automatic watering had time to soak in?
+        # A sensor hovering at the threshold wakes the scheduler on every
+        # crossing, so this keeps the pump to one cycle per interval.
+        recently_watered = (last_auto_water is not None and
+                            time.monotonic() - last_auto_water < SCHEDULER_INTERVAL_SECONDS)
+        
+        # Check if all conditions are met
+        if is_dry and recently_watered:
+            log.info("AUTO-WATERING SKIPPED: Last automatic watering was less than %ds ago.",
+                     SCHEDULER_INTERVAL_SECONDS)
+
+        elif is_dry and not is_rain_delay:
+            if try_begin_watering():
+                log.info("AUTO WATERING TRIGGERED: Moisture Raw (%d) is above threshold (%d).",
+                         state.moisture_raw, MOISTURE_THRESHOLD)
+
+                # Queue the "WET" command for the Arduino
+                pending_commands.append("WET")
+            else:
+                log.info("AUTO-WATERING SKIPPED: A watering cycle is already running.")
+            
+        elif is_dry and is_rain_delay:
+            log.info("AUTO-WATERING SKIPPED: Soil is dry but weather is %s (Rain Delay active).", state.weather_desc)
+
+    if pending_commands:
+        success = send_commands_to_arduino(pending_commands)
+
+        if "WET" in pending_commands:
+            if success:
+                # Update state, the timer clears the flag when the pump cycle completes
+                last_auto_water = time.monotonic()
+                update_state(last_water=now_hms() + " - AUTO")
+                start_watering_timer()
+            else:
+                clear_watering_flag() # Nothing was sent, release the pump
 
 
 def auto_watering_scheduler():
     """Checks conditions and triggers watering if needed."""
-    global system_state
     
     # Wait for the system to settle before starting automation
     time.sleep(15) 
     
     while True:
-        if system_state['auto_watering_enabled']:
-            
-            # Condition 1: Is the soil dry enough?
-            is_dry = system_state['moisture_raw'] > MOISTURE_THRESHOLD
-            
-            # Condition 2: Is it raining or about to rain?
-            is_rain_delay = system_state['weather_rain']
-            
-            # Check if all conditions are met
-            if is_dry and not is_rain_delay:
-                print("--- AUTO WATERING TRIGGERED ---")
-                print(f"  Moisture Raw ({system_state['moisture_raw']}) is above threshold ({MOISTURE_THRESHOLD}).")
-                
-                # Send the "WET" command to the Arduino
-                success = send_command_to_arduino("WET")
-                
-                if success:
-                    # Update state and wait for the pump cycle to complete
-                    system_state['last_water'] = datetime.now().strftime("%H:%M:%S - AUTO")
-                    time.sleep(WATERING_DURATION_SECONDS + 1) # Wait for pump duration + 1s buffer
-                
-            elif is_dry and is_rain_delay:
-                print(f"AUTO-WATERING SKIPPED: Soil is dry but weather is {system_state['weather_desc']} (Rain Delay active).")
-            
-        time.sleep(SCHEDULER_INTERVAL_SECONDS)
+        run_scheduler_check()
+
+        # Sleep until a relevant state change, re-checking on a timer regardless
+        scheduler_wakeup.wait(timeout=SCHEDULER_INTERVAL_SECONDS)
+        scheduler_wakeup.clear()
 
 
 # --- 5. FLASK APPLICATION SETUP ---
@@ -256,72 +675,126 @@ def auto_watering_scheduler():
 app = Flask(__name__)
 app.secret_key = 'super_secret_key_for_testing' # Required for flash messages
 
+def json_response(obj, status=200):
+    """Serializes obj with orjson, a drop-in for jsonify() on the API routes."""
+    return Response(orjson.dumps(obj), status=status, mimetype='application/json')
+
 # Route for the main dashboard
 @app.route('/')
 def index():    
     """Renders the main monitoring dashboard."""
-    # Pass the current system state to the HTML template
-    if not system_state['arduino_connected']:
-        # Use flash to send a message to the template
-        flash('Arduino not connected. Please check the USB connection and ensure the device has power.', 'danger')
-    return render_template('index.html', state=system_state)
+    connected = system_state.arduino_connected
+    html = index_html_cache.get(connected)
+    if html is None:
+        # Live values come from /data, so the template only needs the warning
+        error = None
+        if not connected:
+            error = 'Arduino not connected. Please check the USB connection and ensure the device has power.'
+        html = index_html_cache[connected] = render_template('index.html', error=error)
+    return html
 
 # Route to get the current sensor data (for JavaScript updates)
 @app.route('/data', methods=['GET'])
 def get_data():
     """Returns the current system state as JSON."""
-    return jsonify(system_state)
+    global data_cache, last_dashboard_poll
+    if weather_refresh_pending:
+        weather_wakeup.set() # A dashboard opened, refresh the weather it shows
+    last_dashboard_poll = time.monotonic()
+    # Snapshots are immutable, so the body only needs rebuilding when a new one
+    # has been published. orjson serializes the dataclass directly.
+    state = system_state
+    cached_state, body = data_cache
+    if cached_state is not state:
+        body = orjson.dumps(state)
+        data_cache = (state, body)
+    return Response(body, mimetype='application/json')
 
 # Route for manual watering control
 @app.route('/water_manual', methods=['POST'])
 def water_manual():
     """Triggers the pump manually from the web UI."""
-    print("Manual watering requested...")
+    log.info("Manual watering requested...")
+
+    if not try_begin_watering():
+        return json_response({'status': 'busy', 'message': 'A watering cycle is already running.'}, 409)
     
     # Send the "WET" command to the Arduino
     success = send_command_to_arduino("WET")
     
     if success:
-        system_state['last_water'] = datetime.now().strftime("%H:%M:%S - MANUAL")
-        # Simulate pump run time for immediate feedback
-        # NOTE: This blocks the current web request for 4 seconds, fine for a small project.
-        time.sleep(WATERING_DURATION_SECONDS + 1) 
-        return jsonify({'status': 'success', 'message': 'Manual watering initiated.'}), 200
+        update_state(last_water=now_hms() + " - MANUAL")
+        # Return right away, the dashboard sees the cycle finish through /data
+        start_watering_timer()
+        return json_response({'status': 'accepted', 'message': 'Manual watering initiated.'}, 202)
     else:
-        return jsonify({'status': 'error', 'message': 'Serial connection not available. Check Arduino power.'}), 500
+        clear_watering_flag() # Nothing was sent, release the pump
+        return json_response({'status': 'error', 'message': 'Serial connection not available. Check Arduino power.'}, 500)
 
 # Route to toggle automatic watering
 @app.route('/toggle_auto', methods=['POST'])
 def toggle_auto():
     """Toggles the automatic watering schedule on/off."""
-    system_state['auto_watering_enabled'] = not system_state['auto_watering_enabled']
+    global system_state
+    with state_lock:
+        system_state = replace(system_state, auto_watering_enabled=not system_state.auto_watering_enabled)
+        enabled = system_state.auto_watering_enabled
     
-    if system_state['auto_watering_enabled']:
+    if enabled:
         message = "Automatic watering ENABLED."
+        if weather_refresh_pending:
+            weather_wakeup.set() # The weather thread wakes the scheduler once it has fresh data
+        else:
+            wake_scheduler()
     else:
         message = "Automatic watering DISABLED."
         
-    print(message)
-    return jsonify({'status': 'success', 'message': message, 'enabled': system_state['auto_watering_enabled']}), 200
+    log.info(message)
+    return json_response({'status': 'success', 'message': message, 'enabled': enabled}, 200)
 
 # --- 6. START THREADS AND FLASK ---
 
+def start_background_threads():
+    """Starts the serial reader, weather and scheduler threads.
+
+    Each worker spends its time blocked on I/O (the serial fd, the weather
+    request or a sleep), so they hold the GIL only while handling a reading."""
+    workers = [
+        ('serial-reader', read_serial_thread),    # Continuous Arduino reader
+        ('weather', update_weather_thread),       # Weather updates
+        ('scheduler', auto_watering_scheduler),   # Auto-watering logic
+    ]
+    for name, target in workers:
+        worker = threading.Thread(target=target, name=name)
+        worker.daemon = True
+        worker.start()
+
+
+def run_production_server():
+    """Serves the app with gunicorn: one process (it owns the serial port and
+    the state) with a pool of threads for concurrent dashboard requests."""
+    from gunicorn.app.base import BaseApplication
+
+    class PlantMonitorServer(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', '0.0.0.0:5000')
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('workers', 1)
+            self.cfg.set('threads', 8)
+            # Threads don't survive gunicorn's fork, so start them in the worker
+            self.cfg.set('post_worker_init', lambda worker: start_background_threads())
+
+        def load(self):
+            return app
+
+    PlantMonitorServer().run()
+
+
 if __name__ == '__main__':
-    # Start the continuous Arduino reader thread
-    serial_thread = threading.Thread(target=read_serial_thread)
-    serial_thread.daemon = True 
-    serial_thread.start()
-
-    # Start the weather update thread
-    weather_thread = threading.Thread(target=update_weather_thread)
-    weather_thread.daemon = True
-    weather_thread.start()
-
-    # Start the auto-watering logic thread
-    scheduler_thread = threading.Thread(target=auto_watering_scheduler)
-    scheduler_thread.daemon = True
-    scheduler_thread.start()
-
-    # Start the Flask web server on all interfaces (0.0.0.0)
     # The Pi's IP address (e.g., 192.168.1.100:5000) will be accessible
-    app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+    if DEV_SERVER:
+        start_background_threads()
+        # Start the Flask web server on all interfaces (0.0.0.0)
+        app.run(host='0.0.0.0', port=5000, debug=False)
+    else:
+        run_production_server()
@@ -9,7 +9,7 @@
 # **********************************************************************
 
 # This script performs the following tasks on the Raspberry Pi:
-# 1. Installs necessary Python dependencies (Flask, pyserial, requests).
+# 1. Installs necessary Python dependencies (Flask, pyserial, requests, orjson, gunicorn).
 # 2. Creates the project directory structure.
 # 3. Copies the application files (app.py, templates/index.html).
 # 4. Finds the Python 3 executable path.
@@ -22,7 +22,7 @@
 PROJECT_DIR="/home/pi/plantmonitor"
 SERVICE_NAME="plantmonitor.service"
 SERVICE_PATH="/etc/systemd/system/$SERVICE_NAME"
-PYTHON_DEPS="Flask pyserial requests flash"
+PYTHON_DEPS="Flask pyserial requests orjson gunicorn flash"
 
 # --- 1. ARGUMENT CHECK ---
 if [ "$#" -ne 2 ]; then
@@ -24,7 +24,15 @@ const int RELAY_OFF = HIGH;
 // The Python server specifies the duration, but we'll use this if running manually
 const unsigned long WATERING_DURATION_MS = 3000; // 3 seconds of watering
 
-// --- 3. TIMING & DATA VARIABLES ---
+// --- 3. SERIAL PROTOCOL ---
+// Set to 1 to send the old text format (MOISTURE_RAW,TEMP_C,HUMIDITY_PCT) and
+// start app.py with --legacy-csv. The default is a 7-byte binary packet:
+// sync 0xAA | uint16 moisture raw | float16 temp C | uint8 humidity % | uint8 CRC-8
+#define LEGACY_CSV 0
+const uint8_t PACKET_SYNC = 0xAA;
+const uint8_t PACKET_SIZE = 7;
+
+// --- 4. TIMING & DATA VARIABLES ---
 const long SERIAL_REPORT_INTERVAL = 1000; // Report data every 1 second
 unsigned long previousMillis = 0;
 
@@ -33,7 +41,7 @@ int rawMoisture = 0;
 float temperatureC = 0.0;
 float humidityPct = 0.0;
 
-// --- 4. SETUP FUNCTION ---
+// --- 5. SETUP FUNCTION ---
 void setup() {
   // Initialize serial communication for data transfer with the Raspberry Pi
   Serial.begin(9600); 
@@ -50,7 +58,7 @@ void setup() {
   Serial.println("Arduino Plant Controller Initialized.");
 }
 
-// --- 5. MAIN LOOP ---
+// --- 6. MAIN LOOP ---
 void loop() {
   // --- Task A: Read Sensors (Non-blocking timing) ---
   unsigned long currentMillis = millis();
@@ -75,12 +83,16 @@ void loop() {
     rawMoisture = analogRead(MOISTURE_PIN);
 
     // 3. Send Data to Raspberry Pi (Python)
+#if LEGACY_CSV
     // Format: MOISTURE_RAW,TEMP_C,HUMIDITY_PCT
     Serial.print(rawMoisture);
     Serial.print(",");
     Serial.print(temperatureC, 1); // 1 decimal place
     Serial.print(",");
     Serial.println(humidityPct, 1); // 1 decimal place, ends with newline
+#else
+    sendSensorPacket();
+#endif
   }
   
   // --- Task B: Handle Serial Commands from Pi (Non-blocking check) ---
@@ -97,7 +109,7 @@ void loop() {
   }
 }
 
-// --- 6. ACTUATOR FUNCTION ---
+// --- 7. ACTUATOR FUNCTION ---
 void activatePump(unsigned long duration) {
   // Turn the pump ON
   digitalWrite(RELAY_PIN, RELAY_ON);
@@ -109,4 +121,53 @@ void activatePump(unsigned long duration) {
   // Turn the pump OFF
   digitalWrite(RELAY_PIN, RELAY_OFF);
   Serial.println("Watering cycle complete. Pump OFF.");
-}
\ No newline at end of file
+}
+
+// --- 8. SERIAL PROTOCOL FUNCTIONS ---
+// Sends the latest readings as one binary packet (little-endian fields)
+void sendSensorPacket() {
+  uint8_t packet[PACKET_SIZE];
+  uint16_t tempHalf = floatToHalf(temperatureC);
+  uint8_t humidity = (uint8_t) constrain(lround(humidityPct), 0, 100);
+
+  packet[0] = PACKET_SYNC;
+  packet[1] = rawMoisture & 0xFF;
+  packet[2] = (rawMoisture >> 8) & 0xFF;
+  packet[3] = tempHalf & 0xFF;
+  packet[4] = (tempHalf >> 8) & 0xFF;
+  packet[5] = humidity;
+  packet[6] = crc8(&packet[1], PACKET_SIZE - 2); // CRC covers the payload only
+
+  Serial.write(packet, PACKET_SIZE);
+}
+
+// Converts a float to IEEE 754 half precision (plenty for a 0.1 C reading)
+uint16_t floatToHalf(float value) {
+  uint32_t bits;
+  memcpy(&bits, &value, sizeof(bits));
+
+  uint16_t sign = (bits >> 16) & 0x8000;
+  int16_t exponent = (int16_t)((bits >> 23) & 0xFF) - 127 + 15;
+  uint32_t mantissa = bits & 0x007FFFFF;
+
+  if (exponent <= 0) {
+    return sign; // Too small for a normal half, send zero
+  }
+  if (exponent >= 31) {
+    return sign | 0x7C00; // Out of range, send infinity
+  }
+  // Round to nearest; a carry out of the mantissa correctly bumps the exponent
+  return sign | (uint16_t)(((uint16_t)exponent << 10) + ((mantissa + 0x1000) >> 13));
+}
+
+// CRC-8/MAXIM (Dallas 1-Wire), matches crc8() in app.py
+uint8_t crc8(const uint8_t *data, uint8_t length) {
+  uint8_t crc = 0;
+  while (length--) {
+    crc ^= *data++;
+    for (uint8_t i = 0; i < 8; i++) {
+      crc = (crc & 1) ? (crc >> 1) ^ 0x8C : crc >> 1;
+    }
+  }
+  return crc;
+}
@@ -135,9 +135,9 @@ autoToggle.addEventListener('change', async () => {
 
 // --- 4. Initialization ---
 
-// Set the initial gauge value on page load
-// We use the value passed by Flask/Jinja2
-setGaugeValue(parseFloat(gaugePercentText.textContent));
+// The page is served as a static shell, so fill in every value right away
+// instead of waiting for the first poll
+updateDashboard();
 
 // Start polling for new data every 5 seconds
 setInterval(updateDashboard, 5000);
@@ -2,6 +2,7 @@ import unittest
 from unittest.mock import patch, MagicMock
 import app
 import json
+import struct
 
 class TestPlantMonitorValues(unittest.TestCase):
 
@@ -23,9 +24,21 @@ class TestPlantMonitorValues(unittest.TestCase):
         self.assertIn('moisture_percent', data)
         self.assertIn('weather_desc', data)
         
-    @patch('app.time.sleep')
+    def test_data_route_cached(self):
+        """Test that polls share one serialized body until the state changes."""
+        first = self.client.get('/data').data
+        self.assertEqual(self.client.get('/data').data, first)
+
+        original = app.system_state
+        try:
+            app.update_state(humidity=99.0)
+            self.assertEqual(json.loads(self.client.get('/data').data)['humidity'], 99.0)
+        finally:
+            app.system_state = original
+
+    @patch('app.start_watering_timer')
     @patch('app.send_command_to_arduino')
-    def test_manual_water(self, mock_send_command, mock_sleep):
+    def test_manual_water(self, mock_send_command, mock_timer):
         """Test manual watering triggers the command."""
         mock_send_command.return_value = True
         
@@ -36,12 +49,186 @@ class TestPlantMonitorValues(unittest.TestCase):
         
         # Check if the mock was called with "WET"
         mock_send_command.assert_called_with("WET")
-        self.assertEqual(response.status_code, 200)
+        # The route returns immediately and leaves the pump cycle to the timer
+        self.assertEqual(response.status_code, 202)
+        mock_timer.assert_called_once()
+
+        # A second request while the cycle runs is refused without sending
+        response = self.client.post('/water_manual')
+        self.assertEqual(response.status_code, 409)
+        mock_send_command.assert_called_once()
+        app.clear_watering_flag()
+
+    def test_try_begin_watering_is_exclusive(self):
+        """Test that only one caller can claim the pump at a time."""
+        self.assertTrue(app.try_begin_watering())
+        self.assertFalse(app.try_begin_watering())
+        app.clear_watering_flag()
+        self.assertTrue(app.try_begin_watering())
+        app.clear_watering_flag()
         
+    def test_send_commands_single_write(self):
+        """Test that queued commands go out in one serial write."""
+        mock_ser = MagicMock()
+        mock_ser.is_open = True
+
+        with patch('app.ser', mock_ser):
+            self.assertTrue(app.send_commands_to_arduino(["WET", "LIGHT ON"]))
+        mock_ser.write.assert_not_called() # Only the serial thread writes
+
+        app.flush_tx_queue(mock_ser)
+        app.drain_tx_wakeups()
+        mock_ser.write.assert_called_once_with(b"WET\nLIGHT ON\n")
+
+    def test_dry_soil_wakes_scheduler(self):
+        """Test that crossing the moisture threshold wakes the scheduler."""
+        original = app.system_state
+        try:
+            app.update_state(moisture_raw=app.MOISTURE_THRESHOLD)
+            app.scheduler_wakeup.clear()
+            app.update_state(moisture_raw=app.MOISTURE_THRESHOLD + 1)
+            self.assertTrue(app.scheduler_wakeup.is_set())
+        finally:
+            app.system_state = original
+            app.scheduler_wakeup.clear()
+
+    @patch('app.start_watering_timer', side_effect=lambda: app.clear_watering_flag())
+    @patch('app.send_commands_to_arduino', return_value=True)
+    def test_threshold_noise_waters_once(self, mock_send, mock_timer):
+        """Test that moisture hovering at the threshold only triggers one watering."""
+        original = app.system_state
+        try:
+            app.update_state(auto_watering_enabled=True, weather_rain=False)
+            with patch('app.last_auto_water', None):
+                for moisture_raw in [app.MOISTURE_THRESHOLD - 1, app.MOISTURE_THRESHOLD + 2] * 5:
+                    app.publish_sample(moisture_raw, 21.0, 40.0)
+                    app.run_scheduler_check()
+        finally:
+            app.system_state = original
+            app.scheduler_wakeup.clear()
+
+        mock_send.assert_called_once_with(["WET"])
+
+    @patch('app.API_KEY', 'test-key')
+    @patch('app.weather_session')
+    @patch('app.weather_wakeup')
+    def test_weather_skipped_when_unused(self, mock_wakeup, mock_session):
+        """Test that no weather call is made with auto-watering off and no dashboard open."""
+        original = app.system_state
+        try:
+            app.update_state(auto_watering_enabled=False)
+            mock_wakeup.wait.side_effect = InterruptedError
+            with patch('app.last_dashboard_poll', app.time.monotonic() - app.DASHBOARD_IDLE_SECONDS - 1), \
+                 patch('app.weather_refresh_pending', False):
+                with self.assertRaises(InterruptedError):
+                    app.update_weather_thread()
+                self.assertTrue(app.weather_refresh_pending)
+        finally:
+            app.system_state = original
+
+        mock_wakeup.wait.assert_called_once_with(timeout=app.WEATHER_IDLE_CHECK_SECONDS)
+
+        mock_session.get.assert_not_called()
+
+    @patch('app.API_KEY', 'test-key')
+    @patch('app.weather_session')
+    @patch('app.time.sleep', side_effect=InterruptedError)
+    def test_weather_html_reply_serves_stale(self, mock_sleep, mock_session):
+        """Test that a non-JSON reply (e.g. a captive portal) falls back to stale weather."""
+        response = MagicMock()
+        response.headers = {'Content-Type': 'text/html; charset=utf-8'}
+        mock_session.get.return_value.__enter__.return_value = response
+
+        original = app.system_state
+        try:
+            app.scheduler_wakeup.clear()
+            with patch.dict(app.last_weather, {'ts': app.time.time() - 600, 'desc': 'Clear sky', 'rain': False}), \
+                 patch('app.weather_refresh_pending', True):
+                with self.assertRaises(InterruptedError):
+                    app.update_weather_thread()
+                # The finished cycle releases a scheduler that was waiting on it
+                self.assertFalse(app.weather_refresh_pending)
+            self.assertTrue(app.scheduler_wakeup.is_set())
+            self.assertEqual(app.system_state.weather_desc, 'Clear sky (stale, 10 min old)')
+        finally:
+            app.system_state = original
+            app.scheduler_wakeup.clear()
+
+        response.json.assert_not_called()
+        mock_sleep.assert_called_once_with(app.WEATHER_RETRY_INTERVAL_SECONDS)
+
+    @patch('app.send_commands_to_arduino', return_value=True)
+    def test_enable_after_idle_waits_for_weather(self, mock_send):
+        """Test that re-enabling auto-watering refreshes the weather before watering."""
+        original = app.system_state
+        try:
+            app.update_state(auto_watering_enabled=False, moisture_raw=app.MOISTURE_THRESHOLD + 50)
+            app.scheduler_wakeup.clear()
+            with patch('app.weather_refresh_pending', True), patch('app.weather_wakeup') as mock_wakeup:
+                self.client.post('/toggle_auto')
+                mock_wakeup.set.assert_called_once()
+                self.assertFalse(app.scheduler_wakeup.is_set()) # Left to the weather thread
+
+                app.run_scheduler_check()
+        finally:
+            app.system_state = original
+            app.scheduler_wakeup.clear()
+
+        mock_send.assert_not_called()
+
+    @patch('app.serial.tools.list_ports.comports')
+    @patch('app.os.path.exists', return_value=True)
+    def test_find_port_uses_cached_path(self, mock_exists, mock_comports):
+        """Test that a cached port path skips re-enumerating devices."""
+        with patch('app.last_arduino_port', '/dev/ttyACM0'):
+            self.assertEqual(app.find_arduino_port(), '/dev/ttyACM0')
+        mock_comports.assert_not_called()
+
+    def make_packet(self, moisture_raw, temp_c, humidity):
+        payload = struct.pack('<HeB', moisture_raw, temp_c, humidity)
+        return bytes([app.PACKET_SYNC]) + payload + bytes([app.crc8(payload)])
+
+    def test_parse_sensor_packets(self):
+        """Test that binary packets are decoded and status text is skipped."""
+        buf = bytearray(b'Command Received: WET (Watering)\r\n')
+        buf += self.make_packet(512, 21.5, 40)
+        buf += self.make_packet(480, 22.0, 41)[:3] # Partial packet
+
+        self.assertEqual(app.parse_sensor_packets(buf), [(512, 21.5, 40)])
+        self.assertEqual(len(buf), 3) # Partial packet kept for the next read
+
+    def test_parse_sensor_packets_bad_crc(self):
+        """Test that a corrupted packet is dropped and the stream re-aligns."""
+        corrupt = bytearray(self.make_packet(512, 21.5, 40))
+        corrupt[1] ^= 0xFF
+        buf = corrupt + self.make_packet(480, 22.0, 41)
+
+        self.assertEqual(app.parse_sensor_packets(buf), [(480, 22.0, 41)])
+
+    def test_parse_sensor_packets_warns_on_csv(self):
+        """Test that CSV from old firmware logs a one-time --legacy-csv hint."""
+        with patch('app.legacy_csv_warned', False):
+            buf = bytearray()
+            with self.assertLogs('app', level='WARNING') as logs:
+                # Arrives in fragments, as it does from the port
+                for chunk in [b'512,21', b'.5,40.0\r\n480,', b'22.0,41.0\r\n']:
+                    buf += chunk
+                    self.assertEqual(app.parse_sensor_packets(buf), [])
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('--legacy-csv', logs.output[0])
+
+    def test_parse_sensor_lines_legacy(self):
+        """Test the legacy CSV parser used with --legacy-csv."""
+        buf = bytearray(b'512,21.5,40.0\r\nArduino Plant Controller Initialized.\r\n480,2')
+
+        self.assertEqual(app.parse_sensor_lines(buf), [(512, 21.5, 40.0)])
+        self.assertEqual(buf, bytearray(b'480,2'))
+
     def test_toggle_auto(self):
         """Test toggling auto-watering."""
         # Get initial state
-        initial_state = app.system_state['auto_watering_enabled']
+        initial_state = app.system_state.auto_watering_enabled
         
         response = self.client.post('/toggle_auto')
         self.assertEqual(response.status_code, 200)
@@ -49,7 +236,7 @@ class TestPlantMonitorValues(unittest.TestCase):
         
         # Check if state flipped
         self.assertNotEqual(initial_state, data['enabled'])
-        self.assertEqual(app.system_state['auto_watering_enabled'], data['enabled'])
+        self.assertEqual(app.system_state.auto_watering_enabled, data['enabled'])
 
 if __name__ == '__main__':
     unittest.main()